@@ -1,10 +1,15 @@
 import copy
+import itertools
+import multiprocessing
 import pickle
+from collections.abc import Sequence
 
 import h5py
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from numba import njit, prange
 from tqdm.auto import tqdm
 
 import npyx
@@ -13,6 +18,25 @@ CENTRAL_RANGE = 60
 
 N_CHANNELS = 10
 
+# Raw data chunk cache size (in bytes) used when reading the h5 dataset.
+# HDF5 keeps one such cache per open dataset, it is not shared between the datasets of a neuron group:
+# it only saves decompressing chunks again when the same dataset is read several times or in parts,
+# e.g. chunks larger than the h5py default cache (1MiB) are otherwise re-read for each partial read.
+CHUNK_CACHE_MEM_SIZE = 1024**3
+
+# Number of chunk slots in the cache, a prime number much larger than the number of cached chunks
+CHUNK_CACHE_N_SLOTS = 100003
+
+# Number of processes used to load datasets, capped to avoid thrashing the disk
+N_JOBS = min(multiprocessing.cpu_count(), 8)
+
+# Each worker process takes a while to start (it imports npyx),
+# so a worker is only started for every MIN_NEURONS_PER_JOB neurons to load
+MIN_NEURONS_PER_JOB = 500
+
+# Number of neurons loaded by each task, small enough for the progress bar to be informative
+NEURONS_PER_BATCH = 100
+
 LABELLING = {
     "PkC_cs": 5,
     "PkC_ss": 4,
@@ -47,39 +71,113 @@ def load(file_name):
         return pickle.load(fobj)
 
 
-def get_neuron_attr(hdf5_file_path, id=None, file=None):
+def open_h5(hdf5_file_path, chunk_cache_mem_size=CHUNK_CACHE_MEM_SIZE):
+    """
+    Opens an hdf5 file in read mode with a raw data chunk cache of chunk_cache_mem_size bytes,
+    so that repeated reads of the same chunks do not need to be decompressed again.
+    """
+    return h5py.File(
+        hdf5_file_path,
+        "r",
+        rdcc_nbytes=chunk_cache_mem_size,
+        rdcc_nslots=CHUNK_CACHE_N_SLOTS,
+        rdcc_w0=0.75,
+    )
+
+
+def get_neuron_attr(hdf5_file_path, id=None, file=None, decode_strings=True):
     """
     Prompts the user to select a given neuron's file to load.
-    Otherwise, can specify which neuron's id and which file we want to load directly
+    Otherwise, can specify which neuron's id and which file we want to load directly.
+    hdf5_file_path can either be a path or an already open h5py File (or Group),
+    in which case it is read from directly rather than re-opened.
+    If decode_strings is True, strings are returned as str rather than bytes.
     """
+    if isinstance(hdf5_file_path, h5py.Group):
+        return _get_neuron_attr(hdf5_file_path, id, file, decode_strings)
+    with open_h5(hdf5_file_path) as hdf5_file:
+        return _get_neuron_attr(hdf5_file, id, file, decode_strings)
+
+
+def _get_neuron_attr(hdf5_file, id=None, file=None, decode_strings=True):
     neuron_ids = []
-    with h5py.File(hdf5_file_path, "r") as hdf5_file:
-        for name in hdf5_file:
-            if "neuron" not in name:
-                continue
-            pi = name.split("_")[0]
-            neuron_id = name.split("_")[-1]
-            neuron_ids.append(neuron_id)
-        if id is None:
-            neuron_ids = [int(neuron_id) for neuron_id in neuron_ids]
-            first_input = input(f"Select a neuron id from: {neuron_ids}")
-            if first_input == "":
-                print("No neuron id selected, exiting")
-                return None
-            first_path = f"{str(pi)}_neuron_{str(first_input)}"
-
-            second_input = input(
-                f"Select a file to load from: {ls(hdf5_file[first_path])}"
-            )
-            if second_input == "":
-                print("No attribute selected, exiting")
-                return None
-            second_path = first_path + "/" + str(second_input)
+    for name in hdf5_file:
+        if "neuron" not in name:
+            continue
+        pi = name.split("_")[0]
+        neuron_id = name.split("_")[-1]
+        neuron_ids.append(neuron_id)
+    if id is None:
+        neuron_ids = [int(neuron_id) for neuron_id in neuron_ids]
+        first_input = input(f"Select a neuron id from: {neuron_ids}")
+        if first_input == "":
+            print("No neuron id selected, exiting")
+            return None
+        first_path = f"{str(pi)}_neuron_{str(first_input)}"
+
+        second_input = input(f"Select a file to load from: {ls(hdf5_file[first_path])}")
+        if second_input == "":
+            print("No attribute selected, exiting")
+            return None
+        second_path = first_path + "/" + str(second_input)
+
+        return _read_h5_dataset(hdf5_file[second_path], decode_strings)
+    else:
+        return_path = f"{str(pi)}_neuron_{str(id)}/{str(file)}"
+        return _read_h5_dataset(hdf5_file[return_path], decode_strings)
+
+
+def _read_h5_dataset(dataset, decode_strings=True):
+    """
+    Reads an h5py dataset. If decode_strings is True and the dataset holds strings,
+    they are decoded to str by h5py directly rather than returned as bytes.
+    """
+    if decode_strings and h5py.check_string_dtype(dataset.dtype) is not None:
+        return dataset.asstr()[(...)]
+    return dataset[(...)]
 
-            return hdf5_file[second_path][(...)]
-        else:
-            return_path = f"{str(pi)}_neuron_{str(id)}/{str(file)}"
-            return hdf5_file[return_path][(...)]
+
+def _h5_offset(group, name):
+    """
+    Returns the byte offset in the file of the dataset name in group
+    (of its first chunk if it is chunked, e.g. compressed),
+    or 0 if it has no data in the file or does not exist.
+    """
+    try:
+        dataset_id = group[name].id
+    except KeyError:
+        return 0
+    offset = dataset_id.get_offset()
+    if (
+        offset is None
+        and dataset_id.get_create_plist().get_layout() == h5py.h5d.CHUNKED
+        and dataset_id.get_num_chunks() > 0
+    ):
+        offset = dataset_id.get_chunk_info(0).byte_offset
+    return offset or 0
+
+
+def _h5_size(group, name):
+    """
+    Returns the number of elements of the dataset name in group, or 0 if it does not exist.
+    """
+    try:
+        return group[name].size
+    except KeyError:
+        return 0
+
+
+def _read_into(dataset, buffer):
+    """
+    Reads a 1D boolean h5py dataset into the beginning of buffer and returns that view,
+    or reads it into a new array if it does not fit.
+    """
+    if dataset.dtype != bool or dataset.ndim != 1 or dataset.size > buffer.size:
+        return dataset[(...)]
+    out = buffer[: dataset.size]
+    if dataset.size > 0:
+        dataset.read_direct(out)
+    return out
 
 
 def ls(hdf5_file_path):
@@ -97,19 +195,18 @@ def normalise_wf(wf):
     Custom normalisation so that the through of the waveform is set to -1
     or the peak is set to +1 if the waveform is dendritic
     """
-    baseline = wf[:, :20].mean(axis=1, keepdims=True)
+    wf = np.asarray(wf, dtype=np.float32)
+    baseline = wf[:, :20].mean(axis=1, keepdims=True, dtype=np.float32)
     through = wf.min()
     peak = wf.max()
-    return (
-        (wf - baseline) / np.abs(through)
-        if np.abs(through) > np.abs(peak)
-        else (wf - baseline) / np.abs(peak)
-    )
+    normalised_wf = wf - baseline
+    normalised_wf /= max(np.abs(through), np.abs(peak))
+    return normalised_wf
 
 
 def crop_original_wave(waveform, central_range=60, n_channels=10):
     """
-    It takes a waveform of shape (n_channels, central_range), and returns a copy of the waveform with the central 60 samples in the horizontal
+    It takes a waveform of shape (n_channels, central_range), and returns a view of the waveform with the central 60 samples in the horizontal
     direction, and the central 10 channels in the vertical direction
 
     Args:
@@ -120,8 +217,8 @@ def crop_original_wave(waveform, central_range=60, n_channels=10):
     Returns:
       The waveform cropped to the central range and the number of channels specified.
     """
-    # First argsort to find the peak channels
-    # Then if the absolute max amplitude channel is "too close to the edge", find the second max and so on.
+    # Find the channel with the largest absolute amplitude among the ones that are
+    # far enough from the edges to fit n_channels around them.
     # If the peak channel is in the middle, then just take the central 10 channels
     centre = waveform.shape[1] // 2
     if waveform.shape[0] <= n_channels:
@@ -129,19 +226,77 @@ def crop_original_wave(waveform, central_range=60, n_channels=10):
             :, (centre - central_range // 2) : (centre + central_range // 2)
         ]
 
-    channels_by_amplitude = np.argsort(np.max(np.abs(waveform), axis=1))
+    amplitudes = np.max(np.abs(waveform), axis=1)
+    channels = np.arange(waveform.shape[0])
+    too_close_to_edge = (channels < n_channels // 2) | (
+        channels + n_channels // 2 > waveform.shape[0]
+    )
+    peak_channel = np.argmax(np.where(too_close_to_edge, -1, amplitudes))
 
-    cropped_wvf = np.array([0])
-    i = 1
-    while cropped_wvf.shape[0] < n_channels and i < waveform.shape[0]:
-        peak_channel = channels_by_amplitude[-i]
-        cropped_wvf = waveform[
-            (peak_channel - n_channels // 2) : (peak_channel + n_channels // 2),
-            (centre - central_range // 2) : (centre + central_range // 2),
-        ].copy()
-        i += 1
+    return waveform[
+        (peak_channel - n_channels // 2) : (peak_channel + n_channels // 2),
+        (centre - central_range // 2) : (centre + central_range // 2),
+    ]
 
-    return cropped_wvf
+
+# error_model="numpy": a flat waveform (scale of 0) gives NaNs, as with normalise_wf, instead of raising
+@njit(cache=True, error_model="numpy")
+def _normalise_crop_wf(wf, central_range, n_channels, normalise, out):
+    """
+    Fused equivalent of crop_original_wave(normalise_wf(wf) if normalise else wf, central_range, n_channels).ravel(),
+    written into out without intermediate arrays.
+    Returns False (leaving out untouched) if the cropped waveform would not be of shape (n_channels, central_range).
+    """
+    n_chan, n_samples = wf.shape
+    first_sample = n_samples // 2 - central_range // 2
+    if (
+        central_range % 2 != 0
+        or first_sample < 0
+        or first_sample + central_range > n_samples
+    ):
+        return False
+
+    # Custom normalisation (see normalise_wf): baseline of each channel and global scale
+    baseline = np.zeros(n_chan)
+    scale = 1.0
+    if normalise:
+        n_baseline_samples = min(20, n_samples)
+        through = np.inf
+        peak = -np.inf
+        for c in range(n_chan):
+            for t in range(n_samples):
+                if t < n_baseline_samples:
+                    baseline[c] += wf[c, t]
+                through = min(through, wf[c, t])
+                peak = max(peak, wf[c, t])
+            baseline[c] /= n_baseline_samples
+        scale = max(abs(through), abs(peak))
+
+    # Peak channel (see crop_original_wave)
+    if n_chan <= n_channels:
+        if n_chan != n_channels:
+            return False
+        first_channel = 0
+    else:
+        if n_channels % 2 != 0:
+            return False
+        first_channel = -1
+        max_amplitude = -1.0
+        for c in range(n_channels // 2, n_chan - n_channels // 2 + 1):
+            amplitude = 0.0
+            for t in range(n_samples):
+                amplitude = max(amplitude, abs(wf[c, t] - baseline[c]))
+            if amplitude > max_amplitude:
+                max_amplitude = amplitude
+                first_channel = c - n_channels // 2
+        if first_channel < 0:
+            return False
+
+    for i in range(n_channels):
+        c = first_channel + i
+        for j in range(central_range):
+            out[i * central_range + j] = (wf[c, first_sample + j] - baseline[c]) / scale
+    return True
 
 
 def resample_acg(acg, window_size=20, keep_same_size=True):
@@ -150,25 +305,351 @@ def resample_acg(acg, window_size=20, keep_same_size=True):
     If keep_same_size is True, the ACG will be of the same size: this is achieved
     by undersapling points at the end of the ACG.
     """
-    y = np.array(acg).copy()
-    X = np.linspace(0, len(y), len(y))
+    y = np.asarray(acg)
+    if not np.issubdtype(y.dtype, np.floating):
+        y = y.astype(float)
+    new_y = np.empty(
+        _resampled_acg_size(len(y), window_size, keep_same_size), dtype=y.dtype
+    )
+    _resample_acg(np.ascontiguousarray(y), window_size, keep_same_size, new_y)
+    return new_y
+
+
+def _resampled_acg_size(acg_size, window_size, keep_same_size):
+    if acg_size == 0:
+        return 0
+    enhanced_size = acg_size + min(window_size, acg_size) - 1
+    if not keep_same_size:
+        return enhanced_size
+    start = max(enhanced_size - 2 * window_size, 0)
+    return enhanced_size - (enhanced_size - start + 1) // 2
+
+
+@njit(cache=True)
+def _resample_acg(y, window_size, keep_same_size, out):
+    """
+    Writes the resampled y into out, of size _resampled_acg_size(len(y), window_size, keep_same_size).
+    """
+    if y.shape[0] == 0:
+        return
+    n_window = min(window_size, y.shape[0])
+    enhanced_size = y.shape[0] + n_window - 1
+    # When keeping the same size, every other point among the last 2 * window_size ones is removed
+    start = max(enhanced_size - 2 * window_size, 0) if keep_same_size else out.shape[0]
+
+    for i in range(out.shape[0]):
+        # Index in the ACG enhanced with interpolating points in the first window_size points
+        j = i if i < start else start + 1 + 2 * (i - start)
+        if j >= 2 * n_window - 2:
+            out[i] = y[j - n_window + 1]
+        elif j % 2 == 0:
+            out[i] = y[j // 2]
+        else:
+            out[i] = (y[j // 2] + y[j // 2 + 1]) / 2.0
+
+
+@njit(cache=True)
+def _resample_acgs(acgs, window_size, keep_same_size, out):
+    for k in range(acgs.shape[0]):
+        _resample_acg(acgs[k], window_size, keep_same_size, out[k])
+
+
+def _acg_many(trains, bin_size, win_size, fs=30000):
+    """
+    Computes the autocorrelograms of a list of spike trains (in samples) in one go, in Hertz.
+    Equivalent to calling npyx.corr.acg(dp, u, bin_size, win_size, fs, train=train) on each train,
+    without going through the npyx memory.
+
+    Returns:
+      Array of shape (len(trains), 2 * int(win_size / (2 * bin_size)) + 1)
+    """
+    bin_size = np.clip(bin_size, 1000 * 1.0 / fs, 1e8)
+    n_half_bins = int(0.5 * win_size * 1.0 / bin_size)
+    samples_per_bin = int(np.ceil(fs * bin_size * 1.0 / 1000))
+
+    # Ragged spike trains are passed to numba as one flat array and their boundaries
+    trains = [np.sort(np.asarray(train, dtype=np.int64)) for train in trains]
+    n_spikes = np.array([len(train) for train in trains], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(n_spikes)))
+    spikes = np.concatenate(trains) if trains else np.zeros(0, dtype=np.int64)
+
+    counts = _acg_counts(spikes, offsets, samples_per_bin, n_half_bins)
+
+    # Remove ACG peaks (perfectly correlated with themselves) and symmetrize
+    counts[:, 0] = 0
+    acgs = np.concatenate((counts[:, :0:-1], counts), axis=1).astype(np.float64)
+    return acgs / (n_spikes[:, None] * bin_size * 1.0 / 1000)
+
+
+@njit(cache=True, parallel=True)
+def _acg_counts(spikes, offsets, samples_per_bin, n_half_bins):
+    """
+    Counts, for each sorted train spikes[offsets[k]:offsets[k + 1]],
+    the time differences between spikes in bins of samples_per_bin,
+    up to n_half_bins bins (i.e. the positive half of the ACG).
+    """
+    counts = np.zeros((offsets.shape[0] - 1, n_half_bins + 1), dtype=np.int64)
+    for k in prange(offsets.shape[0] - 1):
+        train = spikes[offsets[k] : offsets[k + 1]]
+        for i in range(train.shape[0]):
+            for j in range(i + 1, train.shape[0]):
+                delta_t_bins = (train[j] - train[i]) // samples_per_bin
+                if delta_t_bins > n_half_bins:
+                    break
+                counts[k, delta_t_bins] += 1
+    return counts
+
+
+def _discarded_neuron(neuron_group, label, reason):
+    dataset_name = _read_h5_dataset(neuron_group["dataset_id"]).ravel()[0]
+    return {
+        "neuron_id": _read_h5_dataset(neuron_group["neuron_id"]).ravel()[0],
+        "label": label,
+        "dataset": dataset_name,
+        "reason": reason,
+    }
+
+
+def _label_to_target(label, labelling):
+    """
+    Maps a neuron label to its int8 target using labelling.
+    Text labels missing from labelling are treated as unlabelled (-1),
+    numeric labels missing from it are kept as they are.
+    """
+    target = labelling.get(label, -1 if isinstance(label, str) else label)
+    if not np.iinfo(np.int8).min <= target <= np.iinfo(np.int8).max:
+        raise ValueError(
+            f"The target {target} of label {label!r} does not fit in int8."
+        )
+    return target
+
+
+def _load_neuron(
+    neuron_group,
+    quality_check,
+    normalise_wvf,
+    central_range,
+    n_channels,
+    reshape_fortran_to_c,
+    _label,
+    _use_amplitudes,
+    mask_buffers=None,
+    wf_buffer=None,
+):
+    """
+    Extracts the data of a single neuron from its h5 group (except for its ACG, see _load_neurons).
+    mask_buffers is an optional (2, n) boolean array the quality masks are read into,
+    to reuse the same memory across neurons.
+    wf_buffer is an optional float32 array of size n_channels * central_range
+    the processed waveform is written into.
+    Returns a (neuron, discarded) tuple: neuron is a dictionary with the extracted data,
+    or None if the neuron was discarded, in which case discarded is a dictionary
+    with the neuron information and the reason why it was discarded.
+    """
+    label = 0
+    try:
+        # Get the label for this wvf
+        label = _read_h5_dataset(neuron_group[_label]).ravel()[0]
+
+        if isinstance(label, bytes):
+            label = label.decode("utf-8")
+
+        # If the neuron is labelled we extract it anyways
+        if label != 0 and isinstance(label, str):
+            neuron_label = label
+
+        elif label != 0:
+            # Numeric labels of any dtype (int32, uint8, float64...) are kept as numbers
+            label = label.item()
+            neuron_label = label
+        else:
+            neuron_label = "unlabelled"
+
+        spike_idxes = neuron_group["spike_indices"][(...)]
+
+        if quality_check:
+            if mask_buffers is None:
+                mask_buffers = np.empty((2, 0), dtype=bool)
+            sane_spikes = _read_into(neuron_group["sane_spikes"], mask_buffers[0])
+            fn_fp_spikes = _read_into(
+                neuron_group["fn_fp_filtered_spikes"], mask_buffers[1]
+            )
+            # np.compress would silently truncate the spikes to a shorter mask
+            if not (sane_spikes.shape == fn_fp_spikes.shape == spike_idxes.shape):
+                return None, _discarded_neuron(
+                    neuron_group, label, "quality masks shape mismatch"
+                )
+            mask = np.logical_and(fn_fp_spikes, sane_spikes, out=sane_spikes)
+            # np.compress already returns a new array, no need to copy
+            spikes = np.compress(mask, spike_idxes)
+        else:
+            spikes = spike_idxes
+
+        # if spikes is void after quality checks, skip this neuron
+        if len(spikes) == 0:
+            return None, _discarded_neuron(neuron_group, label, "quality checks")
+
+        # Extract amplitudes if requested
+        amplitudes = neuron_group["amplitudes"][(...)] if _use_amplitudes else None
+
+        # Extract waveform using provided parameters
+        wf = neuron_group["mean_waveform_preprocessed"][(...)]
+
+        if reshape_fortran_to_c:
+            wf = wf.reshape(list(wf.shape)[::-1])
+
+        # Make sure if we need to transpose the waveform or not
+        if wf.shape[0] > wf.shape[1]:
+            wf = wf.T
+
+        # Also, if the waveform is 1D (i.e. only one channel), we need to tile it to make it 2D.
+        # Alternatively, if it is not spread on enough channels, we want to tile the remaining
+        if wf.squeeze().ndim == 1:
+            wf = np.tile(wf, (n_channels, 1))
+
+        if wf.shape[0] < n_channels:
+            repeats = [wf[0][None, :]] * (n_channels - wf.shape[0])
+            wf = np.concatenate((*repeats, wf), axis=0)
+
+        if wf_buffer is None:
+            wf_buffer = np.empty(n_channels * central_range, dtype=np.float32)
+        if not _normalise_crop_wf(
+            wf, central_range, n_channels, normalise_wvf, wf_buffer
+        ):
+            return None, _discarded_neuron(neuron_group, label, "shape mismatch")
+        wf = wf_buffer
+
+        # Extract useful metadata
+        dataset_name = _read_h5_dataset(neuron_group["dataset_id"]).ravel()[0]
+        neuron_id = _read_h5_dataset(neuron_group["neuron_id"]).ravel()[0]
+        neuron_metadata = dataset_name + "/" + str(neuron_id)
+
+    except KeyError:
+        return None, _discarded_neuron(neuron_group, label, "KeyError")
+
+    neuron = {
+        "wf": wf,
+        "spikes": spikes.astype(int),
+        "label": neuron_label,
+        "info": str(neuron_metadata),
+        "amplitudes": amplitudes,
+    }
+    return neuron, None
+
+
+def _load_neurons(
+    dataset,
+    group_names,
+    chunk_cache_mem_size,
+    normalise_acg,
+    resample_acgs,
+    cut_acg,
+    **kwargs,
+):
+    """
+    Loads the neurons stored at group_names in the h5 dataset, opening the file only once,
+    and computes their ACGs all at once.
+    Runs in a worker process: returns a list of (neuron, discarded) tuples (see _load_neuron),
+    without the waveforms and ACGs, which are returned as two arrays with one row per loaded neuron.
+    """
+    with open_h5(dataset, chunk_cache_mem_size) as hdf5_file:
+        # Buffers large enough to hold the quality masks of any neuron of the batch
+        n_spikes = [_h5_size(hdf5_file[name], "spike_indices") for name in group_names]
+        mask_buffers = np.empty((2, max(n_spikes, default=0)), dtype=bool)
+        # The waveforms of the loaded neurons are written straight into the rows of one array
+        wfs = np.empty(
+            (len(group_names), kwargs["n_channels"] * kwargs["central_range"]),
+            dtype=np.float32,
+        )
+        results = []
+        loaded_neurons = []
+        for name in group_names:
+            neuron, discarded = _load_neuron(
+                hdf5_file[name],
+                mask_buffers=mask_buffers,
+                wf_buffer=wfs[len(loaded_neurons)],
+                **kwargs,
+            )
+            if neuron is not None:
+                del neuron["wf"]
+                loaded_neurons.append(neuron)
+            results.append((neuron, discarded))
+        wfs = wfs[: len(loaded_neurons)]
+
+    # The ACGs of the batch are processed as one (neurons, bins) array
+    acgs = _acg_many([neuron["spikes"] for neuron in loaded_neurons], 1, 200)
+    if normalise_acg:
+        acgs = np.clip(acgs / np.max(acgs, axis=1, keepdims=True), 0, 10)
+    acgs = acgs.astype(np.float32)
+    if cut_acg:
+        acgs = acgs[:, acgs.shape[1] // 2 :]
+    if resample_acgs:
+        resampled_acgs = np.empty(
+            (acgs.shape[0], _resampled_acg_size(acgs.shape[1], 20, True)),
+            dtype=np.float32,
+        )
+        _resample_acgs(acgs, 20, True, resampled_acgs)
+        acgs = resampled_acgs
+
+    return results, wfs, acgs
+
+
+def _ragged_from_list(arrays):
+    """
+    Packs a list of 1D int arrays into one flat array and the offsets delimiting each of them,
+    so that arrays[i] == flat[offsets[i] : offsets[i + 1]].
+    """
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(array) for array in arrays], out=offsets[1:])
+    if len(arrays) == 0:
+        return np.empty(0, dtype=np.int64), offsets
+    return np.concatenate(arrays).astype(np.int64, copy=False), offsets
+
+
+def _take_ragged(flat, offsets, indices):
+    """
+    Gathers the arrays at `indices` of a (flat, offsets) ragged array, without splitting it up.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    lengths = offsets[indices + 1] - offsets[indices]
+    new_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    # Position of each kept element in the original flat array
+    positions = np.arange(new_offsets[-1], dtype=np.int64) + np.repeat(
+        offsets[indices] - new_offsets[:-1], lengths
+    )
+    return flat[positions], new_offsets
+
+
+class _SpikeTrains(Sequence):
+    """
+    Read-only list-like view of the spike trains of a NeuronsDataset, indexing it calls dataset.spikes(i).
+    """
 
-    interpolated_window = y[:window_size]
-    # Create interpolating points
-    avg_arr = (interpolated_window + np.roll(interpolated_window, -1)) / 2.0
-    avg_enhanced = np.vstack([interpolated_window, avg_arr]).flatten("F")[:-1]
+    def __init__(self, dataset):
+        self._dataset = dataset
 
-    # Create new_y enhanced with interpolating points
-    new_y = np.concatenate((avg_enhanced.ravel(), y[window_size:].ravel()), axis=0)
+    def __len__(self):
+        return len(self._dataset._spikes_offsets) - 1
 
-    if keep_same_size == False:
-        return new_y
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("spike train index out of range")
+        return self._dataset.spikes(i)
 
-    # Select final points to remove
-    idxes = np.ones_like(new_y).astype(bool)
-    idxes[-2 * window_size :: 2] = False
+    def __add__(self, other):
+        return list(self) + list(other)
 
-    return new_y[idxes]
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return f"<{len(self)} spike trains>"
 
 
 class NeuronsDataset:
@@ -190,6 +671,8 @@ class NeuronsDataset:
         _label="optotagged_label",
         _labelling=LABELLING,
         _use_amplitudes=False,
+        chunk_cache_mem_size=CHUNK_CACHE_MEM_SIZE,
+        n_jobs=N_JOBS,
     ):
 
         # Store useful metadata about how the dataset was extracted
@@ -197,209 +680,120 @@ class NeuronsDataset:
         self._central_range = central_range
 
         # Initialise empty lists to extract data
-        self.wf_list = []
-        self.acg_list = []
-        self.spikes_list = []
+        spikes_list = []
         self.labels_list = []
         self.info = []
 
         if _use_amplitudes:
             self.amplitudes_list = []
 
-        neuron_ids = []
-        with h5py.File(dataset, "r") as hdf5_file:
+        # chunk_cache_mem_size sets the size (in bytes) of the h5 chunk cache,
+        # lower it if memory is limited.
+        with open_h5(dataset, chunk_cache_mem_size) as hdf5_file:
+            group_names = {}
             for name in hdf5_file:
                 if "neuron" in name:
                     neuron_id = name.split("_")[-1]
-                    neuron_ids.append(int(neuron_id))
-
-        discarded_df = pd.DataFrame(columns=["neuron_id", "label", "dataset", "reason"])
-        for wf_n in tqdm(np.sort(neuron_ids), desc="Reading dataset", leave=False):
-            try:
-                # Get the label for this wvf
-                label = get_neuron_attr(dataset, wf_n, _label).ravel()[0]
-
-                # If the neuron is labelled we extract it anyways
-                if label != 0 and not isinstance(label, (np.ndarray, np.int64)):
-                    label = str(label.decode("utf-8"))
-                    self.labels_list.append(label)
-
-                elif label != 0:
-                    label = label.item()
-                    self.labels_list.append(label)
-                else:
-                    self.labels_list.append("unlabelled")
-
-                spike_idxes = get_neuron_attr(dataset, wf_n, "spike_indices")
-
-                if quality_check:
-                    sane_spikes = get_neuron_attr(dataset, wf_n, "sane_spikes")
-                    fn_fp_spikes = get_neuron_attr(
-                        dataset, wf_n, "fn_fp_filtered_spikes"
-                    )
-                    mask = fn_fp_spikes & sane_spikes
-                    spikes = spike_idxes[mask].copy()
-                else:
-                    spikes = spike_idxes
-
-                # if spikes is void after quality checks, skip this neuron
-                if len(spikes) == 0:
-                    dataset_name = (
-                        get_neuron_attr(dataset, wf_n, "dataset_id")
-                        .ravel()[0]
-                        .decode("utf-8")
-                    )
-                    discarded_df = pd.concat(
-                        (
-                            discarded_df,
-                            pd.DataFrame(
-                                {
-                                    "neuron_id": [
-                                        get_neuron_attr(
-                                            dataset, wf_n, "neuron_id"
-                                        ).ravel()[0]
-                                    ],
-                                    "label": [label],
-                                    "dataset": [dataset_name],
-                                    "reason": ["quality checks"],
-                                }
-                            ),
-                        ),
-                        ignore_index=True,
-                    )
-                    del self.labels_list[-1]
-                    continue
-
-                # Extract amplitudes if requested
-                if _use_amplitudes:
-                    amplitudes = get_neuron_attr(dataset, wf_n, "amplitudes")
-                    self.amplitudes_list.append(amplitudes)
-
-                # Extract waveform using provided parameters
-                wf = get_neuron_attr(dataset, wf_n, "mean_waveform_preprocessed")
-
-                if reshape_fortran_to_c:
-                    wf = wf.reshape(list(wf.shape)[::-1])
-
-                # Make sure if we need to transpose the waveform or not
-                if wf.shape[0] > wf.shape[1]:
-                    wf = wf.T
-
-                # Also, if the waveform is 1D (i.e. only one channel), we need to tile it to make it 2D.
-                # Alternatively, if it is not spread on enough channels, we want to tile the remaining
-                if wf.squeeze().ndim == 1:
-                    wf = np.tile(wf, (n_channels, 1))
-
-                if wf.shape[0] < n_channels:
-                    repeats = [wf[0][None, :]] * (n_channels - wf.shape[0])
-                    wf = np.concatenate((*repeats, wf), axis=0)
-
-                if normalise_wvf:
-                    self.wf_list.append(
-                        crop_original_wave(normalise_wf(wf), central_range, n_channels)
-                        .ravel()
-                        .astype(float)
-                    )
-                else:
-                    self.wf_list.append(
-                        crop_original_wave(wf, central_range, n_channels)
-                        .ravel()
-                        .astype(float)
-                    )
-                if self.wf_list[-1].shape[0] != n_channels * central_range:
-                    dataset_name = (
-                        get_neuron_attr(dataset, wf_n, "dataset_id")
-                        .ravel()[0]
-                        .decode("utf-8")
-                    )
-                    discarded_df = pd.concat(
-                        (
-                            discarded_df,
-                            pd.DataFrame(
-                                {
-                                    "neuron_id": [
-                                        get_neuron_attr(
-                                            dataset, wf_n, "neuron_id"
-                                        ).ravel()[0]
-                                    ],
-                                    "label": [label],
-                                    "dataset": [dataset_name],
-                                    "reason": ["shape mismatch"],
-                                }
-                            ),
-                        ),
-                        ignore_index=True,
-                    )
-                    del self.labels_list[-1]
-                    del self.wf_list[-1]
-                    if hasattr(self, "amplitudes_list"):
-                        del self.amplitudes_list[-1]
-                    continue
-
-                if normalise_acg:
-                    acg = npyx.corr.acg("hello", 4, 1, 200, train=spikes)
-                    normal_acg = np.clip(acg / np.max(acg), 0, 10)
-                    self.acg_list.append(normal_acg.astype(float))
-                else:
-                    acg = npyx.corr.acg("hello", 4, 1, 200, train=spikes)
-                    self.acg_list.append(acg.astype(float))
-                self.spikes_list.append(spikes.astype(int))
-                # Extract useful metadata
-                dataset_name = (
-                    get_neuron_attr(dataset, wf_n, "dataset_id")
-                    .ravel()[0]
-                    .decode("utf-8")
-                )
-                neuron_id = get_neuron_attr(dataset, wf_n, "neuron_id").ravel()[0]
-                if not isinstance(neuron_id, (np.ndarray, np.int64, int)):
-                    neuron_id = neuron_id.decode("utf-8")
-                neuron_metadata = dataset_name + "/" + str(neuron_id)
-                self.info.append(str(neuron_metadata))
-
-            except KeyError:
-                dataset_name = (
-                    get_neuron_attr(dataset, wf_n, "dataset_id")
-                    .ravel()[0]
-                    .decode("utf-8")
-                )
-                discarded_df = pd.concat(
-                    (
-                        discarded_df,
-                        pd.DataFrame(
-                            {
-                                "neuron_id": [
-                                    get_neuron_attr(dataset, wf_n, "neuron_id").ravel()[
-                                        0
-                                    ]
-                                ],
-                                "label": [label],
-                                "dataset": [dataset_name],
-                                "reason": ["KeyError"],
-                            }
-                        ),
-                    ),
-                    ignore_index=True,
-                )
-                continue
+                    group_names[int(neuron_id)] = name
+            neuron_ids = np.sort(list(group_names.keys()))
+
+            # Visit the neurons in the order in which their waveforms are laid out on disk,
+            # so that the file is read sequentially rather than randomly.
+            # The neurons are sorted back by id once loaded.
+            reading_order = sorted(
+                neuron_ids,
+                key=lambda wf_n: _h5_offset(
+                    hdf5_file[group_names[wf_n]], "mean_waveform_preprocessed"
+                ),
+            )
 
+        # Neurons are loaded in parallel, by batches of contiguous neurons
+        # so that each worker only opens the file once per batch.
+        # Small datasets are loaded in this process, as starting workers would take longer.
+        n_jobs = max(
+            1, min(effective_n_jobs(n_jobs), len(reading_order) // MIN_NEURONS_PER_JOB)
+        )
+        n_batches = max(4 * n_jobs, len(reading_order) // NEURONS_PER_BATCH)
+        batches = np.array_split(
+            reading_order, max(1, min(len(reading_order), n_batches))
+        )
+        results = Parallel(n_jobs=n_jobs, return_as="generator")(
+            delayed(_load_neurons)(
+                dataset,
+                [group_names[wf_n] for wf_n in batch],
+                chunk_cache_mem_size,
+                quality_check=quality_check,
+                normalise_wvf=normalise_wvf,
+                normalise_acg=normalise_acg,
+                resample_acgs=resample_acgs,
+                cut_acg=cut_acg,
+                central_range=central_range,
+                n_channels=n_channels,
+                reshape_fortran_to_c=reshape_fortran_to_c,
+                _label=_label,
+                _use_amplitudes=_use_amplitudes,
+            )
+            for batch in batches
+        )
+        batch_results = list(
+            tqdm(results, total=len(batches), desc="Reading dataset", leave=False)
+        )
+        results = {}
+        for batch, (batch_neurons, _, _) in zip(batches, batch_results):
+            results.update(zip(batch, batch_neurons))
+
+        discarded_rows = []
+        loaded_neurons = []
+        rows = {}
+        for wf_n in neuron_ids:
+            neuron, discarded = results[wf_n]
+            if neuron is None:
+                discarded_rows.append(discarded)
+            else:
+                rows[wf_n] = len(loaded_neurons)
+                loaded_neurons.append(neuron)
+        discarded_df = pd.DataFrame(
+            discarded_rows, columns=["neuron_id", "label", "dataset", "reason"]
+        )
         self.discarded_df = discarded_df
-        if cut_acg:
-            acg_list_cut = [x[len(x) // 2 :] for x in self.acg_list]
-        else:
-            acg_list_cut = self.acg_list
-        if resample_acgs:
-            acg_list_resampled = list(map(resample_acg, acg_list_cut))
-        else:
-            acg_list_resampled = acg_list_cut
 
-        self.targets = np.array(
-            (pd.Series(self.labels_list).replace(_labelling).values)
+        # Copy the waveforms and ACGs of each batch into preallocated arrays,
+        # releasing each batch as soon as it is copied rather than stacking them all at the end
+        acg_size = max(
+            (acgs.shape[1] for _, _, acgs in batch_results if len(acgs)), default=0
+        )
+        self.wf = np.empty(
+            (len(loaded_neurons), n_channels * central_range), dtype=np.float32
+        )
+        self.acg = np.empty((len(loaded_neurons), acg_size), dtype=np.float32)
+        for b, batch in enumerate(batches):
+            batch_neurons, wfs, acgs = batch_results[b]
+            batch_rows = [
+                rows[wf_n]
+                for wf_n, (neuron, _) in zip(batch, batch_neurons)
+                if neuron is not None
+            ]
+            self.wf[batch_rows] = wfs
+            self.acg[batch_rows] = acgs
+            batch_results[b] = wfs = acgs = None
+
+        for neuron in loaded_neurons:
+            spikes_list.append(neuron["spikes"])
+            self.labels_list.append(neuron["label"])
+            self.info.append(neuron["info"])
+            if _use_amplitudes:
+                self.amplitudes_list.append(neuron["amplitudes"])
+        self._spikes_flat, self._spikes_offsets = _ragged_from_list(spikes_list)
+
+        self.targets = np.fromiter(
+            (_label_to_target(label, _labelling) for label in self.labels_list),
+            dtype=np.int8,
+            count=len(self.labels_list),
         )
-        self.wf = np.stack(self.wf_list, axis=0)
-        self.acg = np.stack(acg_list_resampled, axis=0)
+        self._build_info_index()
 
         print(
-            f"{len(self.wf_list)} neurons loaded, of which labelled: {sum(self.targets != -1)} \n"
+            f"{len(self.wf)} neurons loaded, of which labelled: {sum(self.targets != -1)} \n"
             f"{len(discarded_df)} neurons discarded, of which labelled: {len(discarded_df[discarded_df.label != 0])}. More details at the 'discarded_df' attribute."
         )
 
@@ -411,14 +805,13 @@ class NeuronsDataset:
         self.wf = self.wf[mask]
         self.acg = self.acg[mask]
         self.targets = self.targets[mask]
-        self.info = np.array(self.info)[mask].tolist()
-        self.spikes_list = np.array(self.spikes_list, dtype=object)[mask].tolist()
-        self.labels_list = np.array(self.labels_list)[mask].tolist()
+        self.info = list(itertools.compress(self.info, mask))
+        self._take_spikes(np.flatnonzero(mask))
+        self.labels_list = list(itertools.compress(self.labels_list, mask))
 
         if hasattr(self, "amplitudes_list"):
-            self.amplitudes_list = np.array(self.amplitudes_list, dtype=object)[
-                mask
-            ].tolist()
+            self.amplitudes_list = list(itertools.compress(self.amplitudes_list, mask))
+        self._build_info_index()
 
     def make_unlabelled_only(self):
         """
@@ -428,14 +821,13 @@ class NeuronsDataset:
         self.wf = self.wf[mask]
         self.acg = self.acg[mask]
         self.targets = self.targets[mask]
-        self.info = np.array(self.info)[mask].tolist()
-        self.spikes_list = np.array(self.spikes_list, dtype=object)[mask].tolist()
-        self.labels_list = np.array(self.labels_list)[mask].tolist()
+        self.info = list(itertools.compress(self.info, mask))
+        self._take_spikes(np.flatnonzero(mask))
+        self.labels_list = list(itertools.compress(self.labels_list, mask))
 
         if hasattr(self, "amplitudes_list"):
-            self.amplitudes_list = np.array(self.amplitudes_list, dtype=object)[
-                mask
-            ].tolist()
+            self.amplitudes_list = list(itertools.compress(self.amplitudes_list, mask))
+        self._build_info_index()
 
     def make_full_dataset(self, wf_only=False, acg_only=False):
         """
@@ -462,15 +854,19 @@ class NeuronsDataset:
             If False, the maximum value of the waveforms will be used. Defaults to False.
         """
         if mean:
-            self._scale_value_wf = (np.sort(self.wf.ravel())[:100]).mean()
-            self._scale_value_acg = (np.sort(self.acg.ravel())[-100:]).mean()
+            # Partial sorts: only the 100 extreme values are needed
+            wf, acg = self.wf.ravel(), self.acg.ravel()
+            k_wf, k_acg = min(100, wf.size), min(100, acg.size)
+            self._scale_value_wf = np.partition(wf, k_wf - 1)[:k_wf].mean()
+            self._scale_value_acg = np.partition(acg, acg.size - k_acg)[-k_acg:].mean()
         else:
-            self._scale_value_wf = np.max(np.abs(self.wf))
-            self._scale_value_acg = np.max(np.abs(self.acg))
+            # max(|x|) without allocating np.abs(x)
+            self._scale_value_wf = max(-float(self.wf.min()), float(self.wf.max()))
+            self._scale_value_acg = max(-float(self.acg.min()), float(self.acg.max()))
 
         if not acg_only:
-            self.wf = self.wf / self._scale_value_wf
-        self.acg = self.acg / self._scale_value_acg
+            self.wf = (self.wf / self._scale_value_wf).astype(self.wf.dtype, copy=False)
+        self.acg = (self.acg / self._scale_value_acg).astype(self.acg.dtype, copy=False)
 
     def filter_out_granule_cells(self):
         """
@@ -479,21 +875,22 @@ class NeuronsDataset:
 
         granule_cell_mask = self.targets == LABELLING["GrC"]
 
-        self.targets = (self.targets[~granule_cell_mask] - 1).astype(int)
+        self.targets = (self.targets[~granule_cell_mask] - 1).astype(np.int8)
         self.full_dataset = self.full_dataset[~granule_cell_mask]
         self.targets[self.targets < 0] = -1  # Reset the label of unlabeled cells
         self.wf = self.wf[~granule_cell_mask]
         self.acg = self.acg[~granule_cell_mask]
-        self.info = np.array(self.info)[~granule_cell_mask].tolist()
-        self.labels_list = np.array(self.labels_list)[~granule_cell_mask].tolist()
-        self.spikes_list = np.array(self.spikes_list, dtype=object)[
-            ~granule_cell_mask
-        ].tolist()
+        self.info = list(itertools.compress(self.info, ~granule_cell_mask))
+        self.labels_list = list(
+            itertools.compress(self.labels_list, ~granule_cell_mask)
+        )
+        self._take_spikes(np.flatnonzero(~granule_cell_mask))
 
         if hasattr(self, "amplitudes_list"):
-            self.amplitudes_list = np.array(self.amplitudes_list, dtype=object)[
-                ~granule_cell_mask
-            ].tolist()
+            self.amplitudes_list = list(
+                itertools.compress(self.amplitudes_list, ~granule_cell_mask)
+            )
+        self._build_info_index()
         # To convert text labels to numbers
         new_labelling = {
             "PkC_cs": 4,
@@ -514,25 +911,60 @@ class NeuronsDataset:
         return new_labelling, new_correspondence
 
     def wvf_from_info(self, dp, unit):
-        info_path = dp + "/" + str(unit)
-        assert info_path in self.info, "No neuron for the dp and unit provided"
-
-        idx = self.info.index(info_path)
+        idx = self._find_neuron(dp, unit)
 
         return self.wf[idx].reshape(self._n_channels, self._central_range)
 
     def train_from_info(self, dp, unit):
-        info_path = dp + "/" + str(unit)
-        assert info_path in self.info, "No neuron for the dp and unit provided"
+        idx = self._find_neuron(dp, unit)
 
-        idx = self.info.index(info_path)
+        return self.spikes(idx)
 
-        return self.spikes_list[idx]
+    def spikes(self, i):
+        """Returns the spike train of the i-th neuron, as a view into the flat spikes array."""
+        return self._spikes_flat[self._spikes_offsets[i] : self._spikes_offsets[i + 1]]
+
+    @property
+    def spikes_list(self):
+        """
+        Read-only list-like access to the spike trains, for backward compatibility.
+        The spike trains are stored as one flat array (`_spikes_flat`) delimited by `_spikes_offsets`,
+        spikes_list[i] is the same view as spikes(i).
+        """
+        return _SpikeTrains(self)
+
+    def _take_spikes(self, indices):
+        self._spikes_flat, self._spikes_offsets = _take_ragged(
+            self._spikes_flat, self._spikes_offsets, indices
+        )
+
+    def __setstate__(self, state):
+        # Datasets pickled before the flat spikes storage store a list of spike trains
+        spikes_list = state.pop("spikes_list", None)
+        self.__dict__.update(state)
+        if spikes_list is not None:
+            self._spikes_flat, self._spikes_offsets = _ragged_from_list(spikes_list)
+
+    def _build_info_index(self):
+        """
+        Maps each neuron's info to its index, to find neurons without scanning the info list.
+        Must be called again whenever info is modified.
+        """
+        self._info_index = {}
+        for i, info_path in enumerate(self.info):
+            self._info_index.setdefault(info_path, i)
+
+    def _find_neuron(self, dp, unit):
+        # Datasets pickled before the index was introduced do not have it
+        if not hasattr(self, "_info_index"):
+            self._build_info_index()
 
-    def plot_from_info(self, dp, unit):
         info_path = dp + "/" + str(unit)
-        assert info_path in self.info, "No neuron for the dp and unit provided"
+        assert info_path in self._info_index, "No neuron for the dp and unit provided"
 
+        return self._info_index[info_path]
+
+    def plot_from_info(self, dp, unit):
         wvf = self.wvf_from_info(dp, unit)
         train = self.train_from_info(dp, unit)
 
@@ -547,28 +979,35 @@ class NeuronsDataset:
 
 def merge_datasets(*args: NeuronsDataset) -> NeuronsDataset:
     """Merges multiple NeuronsDatasets instances into one"""
-    new_dataset = copy.deepcopy(args[0])
     for dataset in args[1:]:
         assert isinstance(dataset, NeuronsDataset)
-        new_dataset.wf = np.vstack((new_dataset.wf, dataset.wf))
-        new_dataset.acg = np.vstack((new_dataset.acg, dataset.acg))
-        new_dataset.targets = np.hstack((new_dataset.targets, dataset.targets))
-        new_dataset.info = np.hstack(
-            (np.array(new_dataset.info), np.array(dataset.info))
-        ).tolist()
-        new_dataset.spikes_list = np.hstack(
-            (
-                np.array(new_dataset.spikes_list, dtype=object),
-                np.array(dataset.spikes_list, dtype=object),
-            )
-        ).tolist()
-        new_dataset.discarded_df = pd.concat(
-            (new_dataset.discarded_df, dataset.discarded_df), axis=0
-        )
-        new_dataset.labels_list = new_dataset.labels_list + dataset.labels_list
 
-        if hasattr(new_dataset, "amplitudes_list"):
-            new_dataset.amplitudes_list = (
-                new_dataset.amplitudes_list + dataset.amplitudes_list
-            )
+    # Concatenate everything at once rather than growing the first dataset
+    new_dataset = copy.deepcopy(args[0])
+    new_dataset.wf = np.concatenate([dataset.wf for dataset in args], axis=0)
+    new_dataset.acg = np.concatenate([dataset.acg for dataset in args], axis=0)
+    new_dataset.targets = np.concatenate([dataset.targets for dataset in args])
+    new_dataset.info = list(
+        itertools.chain.from_iterable(dataset.info for dataset in args)
+    )
+    new_dataset._spikes_flat = np.concatenate(
+        [dataset._spikes_flat for dataset in args]
+    )
+    new_dataset._spikes_offsets = np.zeros(len(new_dataset.wf) + 1, dtype=np.int64)
+    np.cumsum(
+        np.concatenate([np.diff(dataset._spikes_offsets) for dataset in args]),
+        out=new_dataset._spikes_offsets[1:],
+    )
+    new_dataset.discarded_df = pd.concat(
+        [dataset.discarded_df for dataset in args], axis=0
+    )
+    new_dataset.labels_list = list(
+        itertools.chain.from_iterable(dataset.labels_list for dataset in args)
+    )
+
+    if hasattr(new_dataset, "amplitudes_list"):
+        new_dataset.amplitudes_list = list(
+            itertools.chain.from_iterable(dataset.amplitudes_list for dataset in args)
+        )
+    new_dataset._build_info_index()
     return new_dataset
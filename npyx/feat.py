@@ -1624,7 +1624,7 @@ def h5_feature_extraction(
         unit = int(dataset.info[i].split("/")[-1])
         label = CORRESPONDENCE[dataset.targets[i]]
         waveform = dataset.wf[i].reshape(dataset._n_channels, dataset._central_range)
-        spike_train = dataset.spikes_list[i]
+        spike_train = dataset.spikes(i)
         # Recover the channelmap
         try:
             chanmap_path = f"datasets/{dataset.info[i]}/channelmap"
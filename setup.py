@@ -20,7 +20,7 @@ with open("README.md", "r") as readme_file:
 
 requirements = ['ipython', 'numpy', 'scipy', 'pandas', 'numba', 'statsmodels',
                 'matplotlib', 'cmcrameri', 'opencv-python', 'scikit-learn', 'networkx',
-                'psutil', 'joblib', 'tqdm', 'h5py']
+                'psutil', 'joblib>=1.3', 'tqdm', 'h5py']
 
 setup(name='npyx',
       version=get_version("npyx/__init__.py"),
@@ -0,0 +1,62 @@
+import h5py
+import numpy as np
+import pytest
+
+from npyx.datasets import LABELLING, NeuronsDataset
+
+
+def write_neurons(path, labels):
+    """Writes a minimal h5 dataset with one neuron per label."""
+    rng = np.random.default_rng(0)
+    with h5py.File(path, "w") as hdf5_file:
+        for i, label in enumerate(labels):
+            neuron = hdf5_file.create_group(f"hausser_neuron_{i}")
+            neuron["optotagged_label"] = label
+            neuron["dataset_id"] = "2020-01-01_mouse1"
+            neuron["neuron_id"] = i
+            n_spikes = 1000
+            neuron["spike_indices"] = np.sort(
+                rng.integers(0, 30000 * 100, n_spikes)
+            ).astype(np.int64)
+            neuron["sane_spikes"] = np.ones(n_spikes, dtype=bool)
+            neuron["fn_fp_filtered_spikes"] = np.ones(n_spikes, dtype=bool)
+            wf = rng.normal(size=(20, 82)).astype(np.float32)
+            wf[10, 41] -= 10
+            neuron["mean_waveform_preprocessed"] = wf.T
+
+
+@pytest.mark.parametrize("dtype", [np.int32, np.uint8, np.float64])
+def test_numeric_labels(tmp_path, dtype):
+    path = tmp_path / "dataset.h5"
+    labels = [LABELLING["MFB"], 0, LABELLING["PkC_ss"]]
+    write_neurons(path, [np.array(label, dtype=dtype) for label in labels])
+
+    dataset = NeuronsDataset(path)
+
+    assert dataset.labels_list == [LABELLING["MFB"], "unlabelled", LABELLING["PkC_ss"]]
+    assert dataset.targets.tolist() == [LABELLING["MFB"], -1, LABELLING["PkC_ss"]]
+
+
+def test_text_labels(tmp_path):
+    path = tmp_path / "dataset.h5"
+    write_neurons(path, ["PkC_cs", 0, "unknown"])
+
+    dataset = NeuronsDataset(path)
+
+    assert dataset.labels_list == ["PkC_cs", "unlabelled", "unknown"]
+    assert dataset.targets.tolist() == [LABELLING["PkC_cs"], -1, -1]
+
+
+def test_spikes_list(tmp_path):
+    path = tmp_path / "dataset.h5"
+    write_neurons(path, ["PkC_cs", 0, "MLI"])
+
+    dataset = NeuronsDataset(path)
+    dataset.make_labels_only()
+
+    assert len(dataset.spikes_list) == len(dataset) == 2
+    for i, spikes in enumerate(dataset.spikes_list):
+        np.testing.assert_array_equal(spikes, dataset.spikes(i))
+    assert len(dataset.spikes_list + [np.arange(3)]) == 3
+    with pytest.raises(TypeError):
+        dataset.spikes_list[0] = np.arange(3)